@@ -1,8 +1,9 @@
-from .ollama_node import OllamaLLMNode, OllamaNbpCharacter, OllamaCharacterRestore, OllamaImageSaver
+from .ollama_node import OllamaLLMNode, OllamaNbpCharacter, OllamaNbpCharacterBatch, OllamaCharacterRestore, OllamaImageSaver
 
 NODE_CLASS_MAPPINGS = {
     "OllamaLLMNode": OllamaLLMNode,
     "OllamaNbpCharacter": OllamaNbpCharacter,
+    "OllamaNbpCharacterBatch": OllamaNbpCharacterBatch,
     "OllamaCharacterRestore": OllamaCharacterRestore,
     "OllamaImageSaver": OllamaImageSaver
 }
@@ -10,6 +11,7 @@ NODE_CLASS_MAPPINGS = {
 NODE_DISPLAY_NAME_MAPPINGS = {
     "OllamaLLMNode": "Ollama LLM",
     "OllamaNbpCharacter": "Ollama NBP Character",
+    "OllamaNbpCharacterBatch": "Ollama NBP Character Batch",
     "OllamaCharacterRestore": "Ollama Character Restore",
     "OllamaImageSaver": "Ollama Image Saver"
 }
@@ -34,10 +34,8 @@ app.registerExtension({
                     }
 
                     try {
-                        const response = await api.fetchApi("/ollama/get_csv_content", {
-                            method: "POST",
-                            body: JSON.stringify({ label: labelVal }),
-                        });
+                        // GET so the browser cache revalidates with If-None-Match (304 when unchanged)
+                        const response = await api.fetchApi(`/ollama/get_csv_content?label=${encodeURIComponent(labelVal)}`);
 
                         if (response.ok) {
                             const data = await response.json();
@@ -101,7 +99,7 @@ api.addEventListener("ollama.prompt_saved", async (event) => {
     if (restoreNodes.length === 0) return;
 
     try {
-        const response = await api.fetchApi("/ollama/get_csv_prompts", { method: "POST" });
+        const response = await api.fetchApi("/ollama/get_csv_prompts");
         if (response.ok) {
             const newOptions = await response.json();
 
@@ -1,6 +1,7 @@
 import requests
 import json
 import os
+import asyncio
 import folder_paths
 from server import PromptServer
 from aiohttp import web
@@ -10,7 +11,13 @@ import io
 import base64
 import json
 import csv
+import hashlib
+import re
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
 try:
@@ -41,6 +48,372 @@ def get_ollama_models(url="http://127.0.0.1:11434"):
         
     return ["gpt-oss:20b"]
 
+def generation_fingerprint(inputs):
+    """
+    IS_CHANGED value for generation nodes.
+    ComfyUI only passes widget values here; linked inputs are absent and already covered
+    by its input cache, so only the values present are hashed.
+    Fixed-seed runs hash model + inputs so ComfyUI can reuse the cached output.
+    Random (seed 0) runs return NaN, which never equals itself, so they always re-run.
+    """
+    if "seed" in inputs and not inputs["seed"]:
+        return float("NaN")
+    # keep_alive only controls model residency, not the output
+    fingerprint_inputs = {k: v for k, v in inputs.items() if k != "keep_alive"}
+    return hashlib.sha256(json.dumps(fingerprint_inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+# Priority classes for Ollama calls (lower value is served first)
+PRIORITY_CLASSES = {
+    "interactive": 0,
+    "character": 1,
+    "summary": 2,
+    "vision": 3,
+    "background": 4,
+}
+
+# Map "<Node>.<call type>" to a priority class.
+# Unknown call types fall back to "background".
+CALL_PRIORITIES = {
+    "OllamaLLMNode.generate": "interactive",
+    "OllamaNbpCharacter.generate": "character",
+    "OllamaNbpCharacter.summary": "summary",
+    "OllamaImageSaver.vision": "vision",
+    "OllamaNbpCharacter.prefetch": "background",
+}
+
+class _SchedulerTicket:
+    __slots__ = ("priority", "workflow_id", "enqueued_at", "granted")
+
+    def __init__(self, priority, workflow_id):
+        self.priority = priority
+        self.workflow_id = workflow_id
+        self.enqueued_at = time.monotonic()
+        self.granted = threading.Event()
+
+class OllamaScheduler:
+    """
+    Orders requests to Ollama by priority class and limits concurrent requests per host.
+    Within a priority class, workflows are served round-robin so one large batch
+    cannot starve another workflow.
+    """
+
+    def __init__(self, default_limit=None, host_limits=None):
+        if default_limit is None:
+            # Same variable Ollama reads for its own server-side parallelism
+            try:
+                default_limit = int(os.environ.get("OLLAMA_NUM_PARALLEL", "1"))
+            except ValueError:
+                default_limit = 1
+        if host_limits is None:
+            host_limits = self.parse_host_limits(os.environ.get("OLLAMA_HOST_PARALLEL", ""))
+        self.default_limit = max(1, default_limit)
+        self._host_limits = {url.rstrip("/"): max(1, limit) for url, limit in host_limits.items()}
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    @staticmethod
+    def parse_host_limits(value):
+        """
+        Parses "http://host-a:11434=4,http://host-b:11434=2" into {url: limit}.
+        Malformed entries are skipped with a warning.
+        """
+        host_limits = {}
+        for entry in value.split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            url, _, limit = entry.rpartition("=")
+            try:
+                host_limits[url.strip().rstrip("/")] = int(limit)
+            except ValueError:
+                print(f"[OllamaScheduler] Ignoring invalid OLLAMA_HOST_PARALLEL entry: {entry}")
+        return host_limits
+
+    def host_limit(self, url):
+        """
+        Number of concurrent requests allowed for a given Ollama URL.
+        """
+        return self._host_limits.get(url.rstrip("/"), self.default_limit)
+
+    def _host(self, url):
+        # Normalize so "http://h:1" and "http://h:1/" share one queue and limit
+        url = url.rstrip("/")
+        host = self._hosts.get(url)
+        if host is None:
+            host = {
+                "limit": self.host_limit(url),
+                "active": 0,
+                # monotonic time the host last became idle, None while busy
+                "idle_since": 0.0,
+                # priority -> OrderedDict(workflow_id -> deque of tickets)
+                "queues": {p: OrderedDict() for p in PRIORITY_CLASSES.values()},
+                # priority -> [count, total_wait, max_wait]
+                "waits": {p: [0, 0.0, 0.0] for p in PRIORITY_CLASSES.values()},
+            }
+            self._hosts[url] = host
+        return host
+
+    def set_host_limit(self, url, limit):
+        """
+        Sets the number of concurrent requests allowed for a given Ollama URL.
+        """
+        url = url.rstrip("/")
+        with self._lock:
+            self._host_limits[url] = max(1, int(limit))
+            host = self._host(url)
+            host["limit"] = self._host_limits[url]
+            self._dispatch(host)
+
+    def _dispatch(self, host):
+        # Caller must hold self._lock
+        while host["active"] < host["limit"]:
+            ticket = None
+            for priority in sorted(host["queues"]):
+                workflows = host["queues"][priority]
+                if not workflows:
+                    continue
+                # Round-robin: take the head workflow, then move it to the back
+                workflow_id, tickets = next(iter(workflows.items()))
+                ticket = tickets.popleft()
+                if tickets:
+                    workflows.move_to_end(workflow_id)
+                else:
+                    del workflows[workflow_id]
+                break
+
+            if ticket is None:
+                return
+
+            waited = time.monotonic() - ticket.enqueued_at
+            stats = host["waits"][ticket.priority]
+            stats[0] += 1
+            stats[1] += waited
+            stats[2] = max(stats[2], waited)
+
+            host["active"] += 1
+            ticket.granted.set()
+
+    def acquire(self, url, call_type, workflow_id=None):
+        """
+        Blocks until a slot on the given host is granted. Pair with release().
+        """
+        priority = PRIORITY_CLASSES[CALL_PRIORITIES.get(call_type, "background")]
+        if workflow_id is None:
+            workflow_id = getattr(PromptServer.instance, "last_prompt_id", None) or "default"
+
+        ticket = _SchedulerTicket(priority, workflow_id)
+        with self._lock:
+            host = self._host(url)
+            host["idle_since"] = None
+            host["queues"][priority].setdefault(workflow_id, deque()).append(ticket)
+            self._dispatch(host)
+
+        ticket.granted.wait()
+
+    def release(self, url):
+        with self._lock:
+            host = self._host(url)
+            host["active"] = max(0, host["active"] - 1)
+            self._dispatch(host)
+            if host["active"] == 0 and not any(host["queues"].values()):
+                host["idle_since"] = time.monotonic()
+
+    @contextmanager
+    def slot(self, url, call_type, workflow_id=None):
+        """
+        Context manager form of acquire/release.
+        """
+        self.acquire(url, call_type, workflow_id)
+        try:
+            yield
+        finally:
+            self.release(url)
+
+    def idle_seconds(self, url):
+        """
+        Seconds since the host last had a request in flight or waiting (0.0 while busy).
+        """
+        with self._lock:
+            host = self._hosts.get(url.rstrip("/"))
+            if host is None:
+                return float("inf")
+            if host["idle_since"] is None:
+                return 0.0
+            return time.monotonic() - host["idle_since"]
+
+    def stats(self):
+        """
+        Returns queue depth and wait-time metrics per host and priority class.
+        """
+        names = {v: k for k, v in PRIORITY_CLASSES.items()}
+        result = {}
+        with self._lock:
+            for url, host in self._hosts.items():
+                classes = {}
+                for priority, workflows in host["queues"].items():
+                    count, total, max_wait = host["waits"][priority]
+                    classes[names[priority]] = {
+                        "queued": sum(len(t) for t in workflows.values()),
+                        "workflows": len(workflows),
+                        "served": count,
+                        "avg_wait_ms": round(total / count * 1000, 2) if count else 0.0,
+                        "max_wait_ms": round(max_wait * 1000, 2),
+                    }
+                result[url] = {
+                    "limit": host["limit"],
+                    "active": host["active"],
+                    "classes": classes,
+                }
+        return result
+
+# Shared scheduler used by all nodes
+SCHEDULER = OllamaScheduler()
+
+def ollama_post(url, path, payload, call_type, workflow_id=None):
+    """
+    POSTs to the Ollama API through the shared scheduler.
+    """
+    with SCHEDULER.slot(url, call_type, workflow_id):
+        return requests.post(f"{url}{path}", json=payload)
+
+class FieldParseStats:
+    """
+    Counts requested vs successfully parsed element fields per parse mode.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._modes = {}
+
+    def record(self, mode, requested, parsed):
+        found = sum(1 for k in requested if parsed.get(k))
+        with self._lock:
+            stats = self._modes.setdefault(mode, {"runs": 0, "complete_runs": 0, "requested": 0, "parsed": 0})
+            stats["runs"] += 1
+            stats["requested"] += len(requested)
+            stats["parsed"] += found
+            if found == len(requested):
+                stats["complete_runs"] += 1
+        if requested:
+            print(f"[OllamaNbpCharacter] Parsed {found}/{len(requested)} fields ({mode})")
+
+    def stats(self):
+        with self._lock:
+            result = {}
+            for mode, stats in self._modes.items():
+                result[mode] = dict(stats)
+                result[mode]["parse_rate"] = round(stats["parsed"] / stats["requested"], 3) if stats["requested"] else 0.0
+            return result
+
+# Shared field parse counters for OllamaNbpCharacter
+PARSE_STATS = FieldParseStats()
+
+class ConversationStore:
+    """
+    In-memory chat histories for OllamaLLMNode sessions, keyed by session id.
+    Sessions idle longer than `ttl` seconds expire, and the least recently used
+    are evicted once more than `max_sessions` are held.
+    """
+
+    def __init__(self, max_sessions=None, ttl=None):
+        if max_sessions is None:
+            try:
+                max_sessions = int(os.environ.get("OLLAMA_MAX_SESSIONS", "32"))
+            except ValueError:
+                max_sessions = 32
+        if ttl is None:
+            try:
+                ttl = float(os.environ.get("OLLAMA_SESSION_TTL", "60")) * 60
+            except ValueError:
+                ttl = 60 * 60
+        self.max_sessions = max(1, max_sessions)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    @staticmethod
+    def estimate_tokens(text):
+        # Rough average for English text, only used for budget truncation
+        return max(1, len(text) // 4)
+
+    def _evict(self):
+        # Caller must hold self._lock
+        now = time.monotonic()
+        for session_id in [k for k, v in self._sessions.items() if now - v["last_used"] > self.ttl]:
+            del self._sessions[session_id]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def reset(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def build_messages(self, session_id, prompt, token_budget):
+        """
+        Returns (messages, dropped): the stored history plus the new user turn, leaving out
+        the oldest exchanges until the estimated size fits within token_budget.
+        The stored history is not modified; pass `dropped` to append_turn once the turn succeeds.
+        """
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(session_id)
+            if session is None:
+                return [{"role": "user", "content": prompt}], 0
+            
+            session["last_used"] = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            
+            history = session["messages"]
+            total = sum(m["tokens"] for m in history) + self.estimate_tokens(prompt)
+            dropped = 0
+            # Drop user/assistant pairs so roles keep alternating
+            while dropped < len(history) and total > token_budget:
+                for m in history[dropped:dropped + 2]:
+                    total -= m["tokens"]
+                dropped = min(dropped + 2, len(history))
+            
+            messages = [{"role": m["role"], "content": m["content"]} for m in history[dropped:]]
+        
+        messages.append({"role": "user", "content": prompt})
+        return messages, dropped
+
+    def append_turn(self, session_id, prompt, reply, reply_tokens=None, dropped=0):
+        """
+        Stores a completed exchange, applies the truncation from build_messages,
+        and returns the session's turn count.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = {"messages": [], "turns": 0}
+                self._sessions[session_id] = session
+            
+            del session["messages"][:dropped]
+            
+            session["messages"].append({"role": "user", "content": prompt, "tokens": self.estimate_tokens(prompt)})
+            session["messages"].append({"role": "assistant", "content": reply, "tokens": reply_tokens or self.estimate_tokens(reply)})
+            session["turns"] += 1
+            session["last_used"] = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            self._evict()
+            return session["turns"]
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                session_id: {
+                    "turns": session["turns"],
+                    "messages": len(session["messages"]),
+                    "estimated_tokens": sum(m["tokens"] for m in session["messages"]),
+                    "idle_seconds": round(now - session["last_used"], 1),
+                }
+                for session_id, session in self._sessions.items()
+            }
+
+# Shared session store for OllamaLLMNode
+SESSION_STORE = ConversationStore()
+
 class OllamaLLMNode:
     """
     A custom node for ComfyUI that interfaces with a local Ollama instance to generate text.
@@ -61,6 +434,10 @@ class OllamaLLMNode:
             },
             "optional": {
                 "seed": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),
+                # Non-empty session id keeps the conversation server-side and sends only the new turn
+                "session_id": ("STRING", {"default": ""}),
+                "session_token_budget": ("INT", {"default": 4096, "min": 256, "max": 131072, "step": 256}),
+                "reset_session": ("BOOLEAN", {"default": False, "label_on": "Reset Session", "label_off": "Continue Session"}),
             }
         }
 
@@ -70,18 +447,39 @@ class OllamaLLMNode:
     CATEGORY = "Ollama"
     OUTPUT_NODE = True
 
-    def generate_text(self, prompt, model, url, keep_alive, seed=None):
+    @classmethod
+    def IS_CHANGED(s, **kwargs):
+        # Session turns depend on server-side history, so they always re-run
+        if str(kwargs.get("session_id") or "").strip():
+            return float("NaN")
+        return generation_fingerprint(kwargs)
+
+    def generate_text(self, prompt, model, url, keep_alive, seed=None, session_id="", session_token_budget=4096, reset_session=False):
         """
         Generates text using the Ollama API.
+        With a session id, the exchange is continued through /api/chat using the stored history.
         """
-        api_url = f"{url}/api/generate"
+        session_id = (session_id or "").strip()
         
-        payload = {
-            "model": model,
-            "prompt": prompt,
-            "stream": False,
-            "keep_alive": f"{keep_alive}m"
-        }
+        if session_id:
+            if reset_session:
+                SESSION_STORE.reset(session_id)
+            api_path = "/api/chat"
+            messages, dropped = SESSION_STORE.build_messages(session_id, prompt, session_token_budget)
+            payload = {
+                "model": model,
+                "messages": messages,
+                "stream": False,
+                "keep_alive": f"{keep_alive}m"
+            }
+        else:
+            api_path = "/api/generate"
+            payload = {
+                "model": model,
+                "prompt": prompt,
+                "stream": False,
+                "keep_alive": f"{keep_alive}m"
+            }
         
         if seed is not None:
              options = {
@@ -90,11 +488,18 @@ class OllamaLLMNode:
              payload["options"] = options
 
         try:
-            response = requests.post(api_url, json=payload)
+            response = ollama_post(url, api_path, payload, "OllamaLLMNode.generate")
             response.raise_for_status()
             
             result = response.json()
-            generated_text = result.get("response", "")
+            
+            if session_id:
+                generated_text = result.get("message", {}).get("content", "")
+                # Only successful turns are added to the history
+                turns = SESSION_STORE.append_turn(session_id, prompt, generated_text, result.get("eval_count"), dropped)
+                print(f"[OllamaLLMNode] Session '{session_id}' turn {turns}: prompt_eval_count={result.get('prompt_eval_count')}")
+            else:
+                generated_text = result.get("response", "")
             
             print(f"Ollama Generated Text: {generated_text}")
             
@@ -120,6 +525,65 @@ class OllamaNbpCharacter:
         "factual_constraints"
     ]
     
+    # Map snake_case to Title Case (Used for Prompting and Parsing)
+    DISPLAY_NAMES = {
+        "subject": "Subject",
+        "composition": "Composition",
+        "action": "Action",
+        "location": "Location",
+        "style": "Style",
+        "editing_instructions": "Editing Instructions",
+        "camera_lighting": "Camera and lighting details",
+        "specific_text": "Specific text integration",
+        "factual_constraints": "Factual constraints"
+    }
+    
+    # Start of a record in multi-variation output (e.g. "### Variation 2", "**Variation 3:**")
+    RECORD_DELIMITER = re.compile(r"^[#*\s]*variation\s*#?\s*\d+\b.*$", re.IGNORECASE)
+    
+    # Single pass header match for the text parser. Tolerates markdown/bullet/numbered prefixes,
+    # a trailing "(for diagrams)" style note and ":", "-", "–", "—" or "=" as the separator.
+    # Longest names first so alternation is unambiguous.
+    HEADER_KEYS = {v.lower(): k for k, v in DISPLAY_NAMES.items()}
+    HEADER_PATTERN = re.compile(
+        r"^(?:[\s*#>•\-]|\d+[.)])*("
+        + "|".join(re.escape(v) for v in sorted(DISPLAY_NAMES.values(), key=len, reverse=True))
+        + r")(?:\s*\([^)]*\))?[\s*]*(?:[:\-–—=]|$)[\s*]*(.*)$",
+        re.IGNORECASE
+    )
+    
+    OUTPUT_FORMATS = ["Text", "JSON Schema"]
+    
+    # Construct system prompt (Text based, robust to chatty models)
+    SYSTEM_INSTRUCTION = (
+        "You are an expert at creating detailed image generation prompts.\n"
+        "Your task is to generate structured prompt elements with your best imagination based on a user Theme or Randomly.\n"
+        "Describe the character’s clothing in rich and precise detail, either by following the provided Theme or by generating it randomly. The level of detail should adapt to the Composition: for close-up or portrait shots, focus only on upper-body attire and omit any lower-body descriptions; for medium or full-body compositions, ensure that lower-body clothing and footwear are clearly and thoroughly described.\n"
+        "Do NOT output conversational fillers like 'Here is the prompt'. Just output the fields.\n\n"
+        "DEFINITIONS:\n"
+        "• Subject: Who or what is in the image? Be specific. (e.g., a stoic robot barista with glowing blue optics; a fluffy calico cat wearing a tiny wizard hat).\n"
+        "• Composition: How is the shot framed? (e.g., extreme close-up, wide shot, low angle shot, portrait).\n"
+        "• Action: What is happening? (e.g., brewing a cup of coffee, casting a magical spell, mid-stride running through a field).\n"
+        "• Location: Where does the scene take place? (e.g., a futuristic cafe on Mars, a cluttered alchemist's library, a sun-drenched meadow at golden hour).\n"
+        "• Style: What is the overall aesthetic? (e.g., 3D animation, film noir, watercolor painting, photorealistic, 1990s product photography).\n"
+        "• Editing Instructions: For modifying an existing image, be direct and specific. (e.g., change the man's tie to green, remove the car in the background)\n"
+        "• Camera and lighting details: Direct the shot like a cinematographer. (e.g., \"A low-angle shot with a shallow depth of field (f/1.8),\" \"Golden hour backlighting creating long shadows,\" \"Cinematic color grading with muted teal tones.\")\n"
+        "• Specific text integration: Clearly state what text should appear and how it should look. (e.g., \"The headline 'URBAN EXPLORER' rendered in bold, white, sans-serif font at the top.\")\n"
+        "• Factual constraints (for diagrams): Specify the need for accuracy and ensure your inputs themselves are factual (e.g., \"A scientifically accurate cross-section diagram,\" \"Ensure historical accuracy for the Victorian era.\").\n"
+        "\n"
+        "Example:\n"
+        "Composition: A photorealistic close-up portrait, framed from the chest to the top of the head.\n"
+        "Subject: A young woman with pale skin and a very slender, skinny build with a small waist. She is wearing a black satin corset with mesh panels and subtle leather strapping details, accessorized with a simple black velvet choker.\n"
+        "Action: She is seated at a cluttered antique vanity table. Her body is turned away, but she turns her head over her shoulder to look directly into the camera with a sultry, confident gaze. One hand rests on the aged wooden table near a perfume bottle.\n"
+        "Location: A dimly lit, bohemian bedroom in Paris. The background consists of a warm bokeh of tarnished silver hand-mirrors, vintage cosmetics, and heavy, dark tapestries.\n"
+        "Style: Photorealistic, cinematic, and ultra-high resolution (8k). The aesthetic should mimic the look of Kodak Portra 400 film.\n"
+        "Editing Instructions: N/A\n"
+        "Camera and lighting details: Shot on Kodak Portra 400 film. The scene is lit by the warm, soft glow of a vintage desk lamp on the vanity, creating deep shadows and intimate highlights on her décolletage and the metallic hair highlights.\n"
+        "Specific text integration: N/A\n"
+        "Factual constraints (for diagrams): N/A\n"
+        "\n"
+    )
+    
     def __init__(self):
         self.elements_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "elements")
         # Ensure elements dir exists
@@ -162,6 +626,12 @@ class OllamaNbpCharacter:
             
         # Unified Save Toggle for CSV
         inputs["optional"]["save_to_csv"] = ("BOOLEAN", {"default": False, "label_on": "Save to CSV", "label_off": "Don't Save"})
+        
+        # "JSON Schema" constrains the model output via Ollama's `format` and decodes it directly
+        inputs["optional"]["output_format"] = (s.OUTPUT_FORMATS,)
+        
+        # Number of pre-generated Randomised element sets to keep ready (0 disables prefetching)
+        inputs["optional"]["prefetch_pool_size"] = ("INT", {"default": 0, "min": 0, "max": 32, "step": 1})
 
         return inputs
 
@@ -171,34 +641,155 @@ class OllamaNbpCharacter:
     CATEGORY = "Ollama"
     OUTPUT_NODE = True
 
-    def generate_character_prompt(self, theme, model, url, keep_alive, seed=None, **kwargs):
+    @classmethod
+    def IS_CHANGED(s, **kwargs):
+        # Pooled Randomised elements are pre-generated without the seed
+        if (kwargs.get("prefetch_pool_size") or 0) > 0 and "Randomised" in kwargs.values():
+            return float("NaN")
+        return generation_fingerprint(kwargs)
+
+    @classmethod
+    def build_user_instruction(s, theme, to_generate_theme, to_generate_random, output_format="Text", format_note=None):
         """
-        Generates a character prompt using the Ollama API with structured inputs.
+        Builds the output-format request listing the fields to generate.
+        format_note replaces the default output instruction placed before "Response:".
         """
-        import re 
+        user_instruction = f"Context Theme: {theme}\n\nREQUIRED OUTPUT FORMAT:\n"
         
-        api_url = f"{url}/api/generate"
+        # Build the request list
+        if to_generate_theme:
+            user_instruction += "Generate based on Theme:\n"
+            for key in to_generate_theme:
+                user_instruction += f"{s.DISPLAY_NAMES[key]}:\n"
         
-        # 1. Parse Inputs & Identify Generation Needs
-        final_elements = {}
-        to_generate_theme = []
-        to_generate_random = []
+        if to_generate_random:
+            user_instruction += "Generate Randomly (Ignore Theme):\n"
+            for key in to_generate_random:
+                user_instruction += f"{s.DISPLAY_NAMES[key]}:\n"
+        
+        if format_note is None and output_format == "JSON Schema":
+            format_note = f"Respond ONLY with a JSON object using these keys: {', '.join(to_generate_theme + to_generate_random)}\n"
+        
+        if format_note:
+            user_instruction += "\n" + format_note
         
-        # Map snake_case to Title Case (Used for Prompting and Parsing)
-        display_names = {
-            "subject": "Subject",
-            "composition": "Composition",
-            "action": "Action",
-            "location": "Location",
-            "style": "Style",
-            "editing_instructions": "Editing Instructions",
-            "camera_lighting": "Camera and lighting details",
-            "specific_text": "Specific text integration",
-            "factual_constraints": "Factual constraints"
+        user_instruction += "\nResponse:"
+        return user_instruction
+
+    @classmethod
+    def build_json_schema(s, keys):
+        """
+        JSON schema for Ollama's `format` option with one string property per element.
+        """
+        return {
+            "type": "object",
+            "properties": {k: {"type": "string", "description": s.DISPLAY_NAMES[k]} for k in keys},
+            "required": list(keys),
         }
+
+    @classmethod
+    def decode_json_elements(s, data):
+        """
+        Keeps the non-empty string fields of a decoded JSON object.
+        """
+        if not isinstance(data, dict):
+            return {}
+        return {k: v.strip() for k, v in data.items() if k in s.DISPLAY_NAMES and isinstance(v, str) and v.strip()}
+
+    @classmethod
+    def _match_header(s, line):
+        """
+        Returns (key, remainder) if the line starts with a field header, else None.
+        """
+        match = s.HEADER_PATTERN.match(line)
+        if not match:
+            return None
+        return s.HEADER_KEYS[match.group(1).lower()], match.group(2).strip()
+
+    @classmethod
+    def parse_elements(s, content):
+        """
+        Extracts "Header: value" fields from model output into a {key: text} dict.
+        """
+        generated_data = {}
+        
+        # Simple Line Parser Strategy
+        lines = content.split('\n')
+        current_key = None
+        buffer = []
+        
+        def save_buffer(k, buf):
+            if k and buf:
+                generated_data[k] = " ".join(buf).strip()
+        
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            
+            match = s._match_header(line)
+            if match:
+                save_buffer(current_key, buffer)
+                current_key, remainder = match
+                buffer = [remainder] if remainder else []
+            elif current_key:
+                buffer.append(line)
+                    
+        save_buffer(current_key, buffer)
+        return generated_data
+
+    @classmethod
+    def parse_records(s, content):
+        """
+        Splits a multi-record completion into a list of {key: text} dicts.
+        A new record starts at a "Variation N" delimiter line, or when a field repeats
+        within the current record (for models that drop the delimiters).
+        """
+        records = []
+        current = {}
+        current_key = None
+        buffer = []
+        
+        def save_buffer():
+            if current_key and buffer:
+                current[current_key] = " ".join(buffer).strip()
+        
+        for line in content.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            
+            if s.RECORD_DELIMITER.match(line):
+                save_buffer()
+                if current:
+                    records.append(current)
+                current, current_key, buffer = {}, None, []
+                continue
+            
+            match = s._match_header(line)
+            if match:
+                save_buffer()
+                key, remainder = match
+                if key in current:
+                    records.append(current)
+                    current = {}
+                current_key = key
+                buffer = [remainder] if remainder else []
+            elif current_key:
+                buffer.append(line)
         
-        # Reverse map for parsing (Title -> snake_case)
-        title_to_key = {v.lower(): k for k, v in display_names.items()}
+        save_buffer()
+        if current:
+            records.append(current)
+        return records
+
+    def split_element_inputs(self, kwargs):
+        """
+        Sorts the per-element inputs into fixed values, theme fields and random fields.
+        """
+        final_elements = {}
+        to_generate_theme = []
+        to_generate_random = []
 
         for key in self.ELEMENT_INPUTS:
             input_val = kwargs.get(f"{key}_input", "Skip")
@@ -213,251 +804,594 @@ class OllamaNbpCharacter:
                 # Verbatim from file (Should not happen with new inputs, but kept for safety)
                 final_elements[key] = input_val
 
-        # 2. Call Ollama if needed
-        generated_data = {}
+        return final_elements, to_generate_theme, to_generate_random
+
+    @classmethod
+    def generate_elements(s, theme, model, url, keep_alive, seed, to_generate_theme, to_generate_random, call_type="OllamaNbpCharacter.generate", workflow_id=None, output_format="Text", track_parse=True):
+        """
+        Runs one generation request and returns the parsed fields ({} on failure).
+        track_parse=False keeps background traffic out of PARSE_STATS.
+        """
+        requested = to_generate_theme + to_generate_random
+        user_instruction = s.build_user_instruction(theme, to_generate_theme, to_generate_random, output_format)
+
+        payload = {
+            "model": model,
+            "prompt": s.SYSTEM_INSTRUCTION + user_instruction,
+            "stream": False,
+            "keep_alive": f"{keep_alive}m"
+        }
         
-        if to_generate_theme or to_generate_random:
-            # Construct system prompt (Text based, robust to chatty models)
-            system_instruction = (
-                "You are an expert at creating detailed image generation prompts.\n"
-                "Your task is to generate structured prompt elements with your best imagination based on a user Theme or Randomly.\n"
-                "Describe the character’s clothing in rich and precise detail, either by following the provided Theme or by generating it randomly. The level of detail should adapt to the Composition: for close-up or portrait shots, focus only on upper-body attire and omit any lower-body descriptions; for medium or full-body compositions, ensure that lower-body clothing and footwear are clearly and thoroughly described.\n"
-                "Do NOT output conversational fillers like 'Here is the prompt'. Just output the fields.\n\n"
-                "DEFINITIONS:\n"
-                "• Subject: Who or what is in the image? Be specific. (e.g., a stoic robot barista with glowing blue optics; a fluffy calico cat wearing a tiny wizard hat).\n"
-                "• Composition: How is the shot framed? (e.g., extreme close-up, wide shot, low angle shot, portrait).\n"
-                "• Action: What is happening? (e.g., brewing a cup of coffee, casting a magical spell, mid-stride running through a field).\n"
-                "• Location: Where does the scene take place? (e.g., a futuristic cafe on Mars, a cluttered alchemist's library, a sun-drenched meadow at golden hour).\n"
-                "• Style: What is the overall aesthetic? (e.g., 3D animation, film noir, watercolor painting, photorealistic, 1990s product photography).\n"
-                "• Editing Instructions: For modifying an existing image, be direct and specific. (e.g., change the man's tie to green, remove the car in the background)\n"
-                "• Camera and lighting details: Direct the shot like a cinematographer. (e.g., \"A low-angle shot with a shallow depth of field (f/1.8),\" \"Golden hour backlighting creating long shadows,\" \"Cinematic color grading with muted teal tones.\")\n"
-                "• Specific text integration: Clearly state what text should appear and how it should look. (e.g., \"The headline 'URBAN EXPLORER' rendered in bold, white, sans-serif font at the top.\")\n"
-                "• Factual constraints (for diagrams): Specify the need for accuracy and ensure your inputs themselves are factual (e.g., \"A scientifically accurate cross-section diagram,\" \"Ensure historical accuracy for the Victorian era.\").\n"
-                "\n"
-                "Example:\n"
-                "Composition: A photorealistic close-up portrait, framed from the chest to the top of the head.\n"
-                "Subject: A young woman with pale skin and a very slender, skinny build with a small waist. She is wearing a black satin corset with mesh panels and subtle leather strapping details, accessorized with a simple black velvet choker.\n"
-                "Action: She is seated at a cluttered antique vanity table. Her body is turned away, but she turns her head over her shoulder to look directly into the camera with a sultry, confident gaze. One hand rests on the aged wooden table near a perfume bottle.\n"
-                "Location: A dimly lit, bohemian bedroom in Paris. The background consists of a warm bokeh of tarnished silver hand-mirrors, vintage cosmetics, and heavy, dark tapestries.\n"
-                "Style: Photorealistic, cinematic, and ultra-high resolution (8k). The aesthetic should mimic the look of Kodak Portra 400 film.\n"
-                "Editing Instructions: N/A\n"
-                "Camera and lighting details: Shot on Kodak Portra 400 film. The scene is lit by the warm, soft glow of a vintage desk lamp on the vanity, creating deep shadows and intimate highlights on her décolletage and the metallic hair highlights.\n"
-                "Specific text integration: N/A\n"
-                "Factual constraints (for diagrams): N/A\n"
-                "\n"
-            )
-            
-            user_instruction = f"Context Theme: {theme}\n\nREQUIRED OUTPUT FORMAT:\n"
-            
-            # Build the request list
-            if to_generate_theme:
-                user_instruction += "Generate based on Theme:\n"
-                for key in to_generate_theme:
-                    user_instruction += f"{display_names[key]}:\n"
-            
-            if to_generate_random:
-                user_instruction += "Generate Randomly (Ignore Theme):\n"
-                for key in to_generate_random:
-                    user_instruction += f"{display_names[key]}:\n"
-            
-            user_instruction += "\nResponse:"
+        if output_format == "JSON Schema":
+            payload["format"] = s.build_json_schema(requested)
+        
+        if seed is not None:
+            payload["options"] = {"seed": seed}
 
-            payload = {
-                "model": model,
-                "prompt": system_instruction + user_instruction,
-                "stream": False,
-                "keep_alive": f"{keep_alive}m"
-            }
+        try:
+            response = ollama_post(url, "/api/generate", payload, call_type, workflow_id)
+            response.raise_for_status()
+            result_json = response.json()
+            content = result_json.get("response", "")
             
-            if seed is not None:
-                payload["options"] = {"seed": seed}
-
-            try:
-                response = requests.post(api_url, json=payload)
-                response.raise_for_status()
-                result_json = response.json()
-                content = result_json.get("response", "")
-                
-                print(f"Ollama Raw Output: {content}")
+            print(f"Ollama Raw Output: {content}")
 
-                # Robust Text Extraction using Regex / Line Logic
-                # Check for each key we requested
-                
-                # Simple Line Parser Strategy
-                lines = content.split('\n')
-                current_key = None
-                buffer = []
-                
-                def save_buffer(k, buf):
-                    if k and buf:
-                        generated_data[k] = " ".join(buf).strip()
-                
-                # Create a lookup for headers to keys
-                header_map = {}
-                for k, v in display_names.items():
-                    header_map[v.lower()] = k
-                    header_map[v.lower() + ":"] = k
-
-                for line in lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-                        
-                    is_header = False
-                    line_lower = line.lower()
-                    
-                    for header_str, key_id in header_map.items():
-                        if line_lower.startswith(header_str.lower()):
-                            save_buffer(current_key, buffer)
-                            current_key = key_id
-                            buffer = []
-                            
-                            remainder = line[len(header_str):].strip()
-                            if remainder.startswith(":"):
-                                remainder = remainder[1:].strip()
-                            
-                            if remainder:
-                                buffer.append(remainder)
-                            is_header = True
-                            break
-                    
-                    if not is_header:
-                        if current_key:
-                            buffer.append(line)
-                            
-                save_buffer(current_key, buffer)
+        except Exception as e:
+            print(f"Ollama API Error: {e}")
+            if track_parse:
+                PARSE_STATS.record("error", requested, {})
+            return {}
 
-            except Exception as e:
-                print(f"Ollama API Error: {e}")
-                
-        # 3. Assemble Final Prompt & Generate Summary Tag
-        for key in to_generate_theme + to_generate_random:
-            if key in generated_data:
-                final_elements[key] = generated_data[key]
-            else:
-                 final_elements[key] = ""
+        mode = "text"
+        generated_data = None
+        if output_format == "JSON Schema":
+            try:
+                generated_data = s.decode_json_elements(json.loads(content))
+                mode = "json"
+            except json.JSONDecodeError:
+                # Model or server ignored the schema, try the text parser instead
+                mode = "json_fallback"
+        
+        if generated_data is None:
+            generated_data = s.parse_elements(content)
+        
+        if track_parse:
+            PARSE_STATS.record(mode, requested, generated_data)
+        return generated_data
 
+    @classmethod
+    def assemble_prompt(s, final_elements):
         prompt_parts = []
-        for key in self.ELEMENT_INPUTS:
+        for key in s.ELEMENT_INPUTS:
             if key in final_elements:
                 val = str(final_elements[key])
-                name = display_names[key]
+                name = s.DISPLAY_NAMES[key]
                 if val and val.strip():
                     prompt_parts.append(f"{name}: {val}")
         
-        full_text = "\n".join(prompt_parts)
+        return "\n".join(prompt_parts)
+
+    @classmethod
+    def generate_summary_tag(s, full_text, theme, final_elements, model, url, keep_alive):
+        """
+        Generates the short summary tag used as the CSV label.
+        """
+        # Generate Summary Tag using AI
+        # Schema: thm-[2words]_sbj-[2words]_loc-[2words]_act-[2words]
         
-        # 4. Save to CSV Logic
-        if kwargs.get("save_to_csv", False):
-            try:
-                # Generate Summary Tag using AI
-                # Schema: thm-[2words]_sbj-[2words]_loc-[2words]_act-[2words]
-                
-                print("[OllamaNbpCharacter] Generating AI Summary Tag...")
-                
-                summary_prompt = (
-                    "Analyze the following character description and extract 4 key elements: Theme, Subject, Location, and Action.\n"
-                    "For each element, summarize it into exactly THREE words.\n"
-                    "Format the output string EXACTLY like this: thm-word_word_word_sbj-word_word_word_loc-word_word_word_act-word_word_word\n"
-                    "Use lowercase only. Use underscores between words in a pair. Use hyphens between the tag name and the words.\n"
-                    "Do NOT output anything else. No intro, no explanation.\n\n"
-                    f"Description:\n{full_text}\n"
-                    f"Context Theme: {theme}\n"
-                )
-                
-                summary_payload = {
-                    "model": model,
-                    "prompt": summary_prompt,
-                    "stream": False,
-                    "keep_alive": f"{keep_alive}m",
-                    "options": {"temperature": 0.1} # Low temp for strict formatting
-                }
-                
-                summary_tag = "thm-na_sbj-na_loc-na_act-na" # Default fallback
-                
-                try:
-                    s_response = requests.post(api_url, json=summary_payload)
-                    s_response.raise_for_status()
-                    s_data = s_response.json()
-                    s_content = s_data.get("response", "").strip().lower()
-                    
-                    # Basic validation: check if it looks roughly right
-                    if "thm-" in s_content and "sbj-" in s_content:
-                        # Clean up any extra whitespace or newlines
-                        s_content = "".join(s_content.split())
-                        summary_tag = s_content
-                        print(f"[OllamaNbpCharacter] AI Summary: {summary_tag}")
-                    else:
-                        print(f"[OllamaNbpCharacter] AI Summary failed validation, text was: {s_content}")
-                        # Fallback to regex if AI fails hard?
-                        # For now, let's trust the AI or leave the error visible so user knows.
-                        summary_tag = s_content if s_content else "error_generating_summary"
-                        
-                except Exception as e:
-                    print(f"[OllamaNbpCharacter] AI Summary API Error: {e}")
-                    # Fallback to simple construction if API fails
-                    def get_tag_words(text):
-                        if not text: return "na"
-                        words = [w for w in re.findall(r'\w+', text.lower()) if len(w) > 2]
-                        return "_".join(words[:2]) if words else "na"
-
-                    sbj_t = get_tag_words(final_elements.get("subject", ""))
-                    loc_t = get_tag_words(final_elements.get("location", ""))
-                    thm_t = get_tag_words(theme)
-                    act_t = get_tag_words(final_elements.get("action", ""))
-                    summary_tag = f"thm-{thm_t}_sbj-{sbj_t}_loc-{loc_t}_act-{act_t}"
-
-                csv_file_path = os.path.join(self.elements_dir, "prompts.csv")
-                file_exists = os.path.exists(csv_file_path)
+        print("[OllamaNbpCharacter] Generating AI Summary Tag...")
+        
+        summary_prompt = (
+            "Analyze the following character description and extract 4 key elements: Theme, Subject, Location, and Action.\n"
+            "For each element, summarize it into exactly THREE words.\n"
+            "Format the output string EXACTLY like this: thm-word_word_word_sbj-word_word_word_loc-word_word_word_act-word_word_word\n"
+            "Use lowercase only. Use underscores between words in a pair. Use hyphens between the tag name and the words.\n"
+            "Do NOT output anything else. No intro, no explanation.\n\n"
+            f"Description:\n{full_text}\n"
+            f"Context Theme: {theme}\n"
+        )
+        
+        summary_payload = {
+            "model": model,
+            "prompt": summary_prompt,
+            "stream": False,
+            "keep_alive": f"{keep_alive}m",
+            "options": {"temperature": 0.1} # Low temp for strict formatting
+        }
+        
+        summary_tag = "thm-na_sbj-na_loc-na_act-na" # Default fallback
+        
+        try:
+            s_response = ollama_post(url, "/api/generate", summary_payload, "OllamaNbpCharacter.summary")
+            s_response.raise_for_status()
+            s_data = s_response.json()
+            s_content = s_data.get("response", "").strip().lower()
+            
+            # Basic validation: check if it looks roughly right
+            if "thm-" in s_content and "sbj-" in s_content:
+                # Clean up any extra whitespace or newlines
+                s_content = "".join(s_content.split())
+                summary_tag = s_content
+                print(f"[OllamaNbpCharacter] AI Summary: {summary_tag}")
+            else:
+                print(f"[OllamaNbpCharacter] AI Summary failed validation, text was: {s_content}")
+                # Fallback to regex if AI fails hard?
+                # For now, let's trust the AI or leave the error visible so user knows.
+                summary_tag = s_content if s_content else "error_generating_summary"
                 
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        except Exception as e:
+            print(f"[OllamaNbpCharacter] AI Summary API Error: {e}")
+            # Fallback to simple construction if API fails
+            def get_tag_words(text):
+                if not text: return "na"
+                words = [w for w in re.findall(r'\w+', text.lower()) if len(w) > 2]
+                return "_".join(words[:2]) if words else "na"
+
+            sbj_t = get_tag_words(final_elements.get("subject", ""))
+            loc_t = get_tag_words(final_elements.get("location", ""))
+            thm_t = get_tag_words(theme)
+            act_t = get_tag_words(final_elements.get("action", ""))
+            summary_tag = f"thm-{thm_t}_sbj-{sbj_t}_loc-{loc_t}_act-{act_t}"
+
+        return summary_tag
+
+    def save_to_csv(self, rows):
+        """
+        Appends (summary_tag, full_text) rows to prompts.csv in a single write.
+        """
+        try:
+            csv_file_path = os.path.join(self.elements_dir, "prompts.csv")
+            file_exists = os.path.exists(csv_file_path)
+            
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            
+            # Labels are "{timestamp} - {tag}" and lookups return the first match,
+            # so suffix repeated tags (within this batch or the same second) to keep each row reachable
+            try:
+                _, _, contents = PROMPT_HISTORY.snapshot()
+                used_labels = set(contents)
+            except Exception:
+                used_labels = set()
+            
+            unique_rows = []
+            for summary_tag, full_text in rows:
+                unique_tag = summary_tag
+                n = 1
+                while f"{timestamp} - {unique_tag}" in used_labels:
+                    n += 1
+                    unique_tag = f"{summary_tag}_{n}"
+                used_labels.add(f"{timestamp} - {unique_tag}")
+                unique_rows.append((unique_tag, full_text))
+            rows = unique_rows
+            
+            # Buffer all rows so the file is opened and written once
+            out = io.StringIO()
+            fieldnames = ['Timestamp', 'SummaryTag', 'FullPrompt']
+            writer = csv.DictWriter(out, fieldnames=fieldnames)
+
+            if not file_exists:
+                writer.writeheader()
+
+            for summary_tag, full_text in rows:
+                writer.writerow({
+                    'Timestamp': timestamp, 
+                    'SummaryTag': summary_tag, 
+                    'FullPrompt': full_text
+                })
+            
+            with open(csv_file_path, mode='a', newline='', encoding='utf-8') as csvfile:
+                csvfile.write(out.getvalue())
+            
+            PROMPT_HISTORY.invalidate()
                 
-                with open(csv_file_path, mode='a', newline='', encoding='utf-8') as csvfile:
-                    fieldnames = ['Timestamp', 'SummaryTag', 'FullPrompt']
-                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-                    if not file_exists:
-                        writer.writeheader()
-
-                    writer.writerow({
-                        'Timestamp': timestamp, 
-                        'SummaryTag': summary_tag, 
-                        'FullPrompt': full_text
-                    })
-                    
+            for summary_tag, _ in rows:
                 print(f"[OllamaNbpCharacter] Saved to CSV: {summary_tag}")
-                
-                # Emit event to notify frontend
-                try:
-                    PromptServer.instance.send_sync("ollama.prompt_saved", {
-                         "summary": summary_tag,
-                         "timestamp": timestamp
-                    })
-                except Exception as e:
-                    print(f"Error emitting event: {e}")
-                
+            
+            # Emit event to notify frontend
+            try:
+                PromptServer.instance.send_sync("ollama.prompt_saved", {
+                     "summary": rows[-1][0],
+                     "timestamp": timestamp
+                })
             except Exception as e:
-                print(f"[OllamaNbpCharacter] Error saving CSV: {e}")
+                print(f"Error emitting event: {e}")
+            
+        except Exception as e:
+            print(f"[OllamaNbpCharacter] Error saving CSV: {e}")
+
+    def generate_character_prompt(self, theme, model, url, keep_alive, seed=None, **kwargs):
+        """
+        Generates a character prompt using the Ollama API with structured inputs.
+        """
+        # 1. Parse Inputs & Identify Generation Needs
+        final_elements, to_generate_theme, to_generate_random = self.split_element_inputs(kwargs)
+
+        # 2. Take Randomised elements from the prefetch pool (they ignore the theme)
+        generated_data = {}
+        pooled = None
+        live_random = to_generate_random
+        
+        prefetch_pool_size = kwargs.get("prefetch_pool_size", 0)
+        if to_generate_random and prefetch_pool_size > 0:
+            pooled = RANDOM_ELEMENT_POOL.take(url, model, to_generate_random, prefetch_pool_size, keep_alive)
+            if pooled:
+                print(f"[OllamaNbpCharacter] Using pre-generated random elements: {', '.join(to_generate_random)}")
+                live_random = []
+
+        # 3. Call Ollama if needed
+        if to_generate_theme or live_random:
+            generated_data.update(self.generate_elements(
+                theme, model, url, keep_alive, seed, to_generate_theme, live_random,
+                output_format=kwargs.get("output_format", "Text")
+            ))
+
+        if pooled:
+            generated_data.update(pooled)
+                
+        # 4. Assemble Final Prompt
+        for key in to_generate_theme + to_generate_random:
+            final_elements[key] = generated_data.get(key, "")
+
+        full_text = self.assemble_prompt(final_elements)
+        
+        # 5. Save to CSV Logic
+        if kwargs.get("save_to_csv", False):
+            summary_tag = self.generate_summary_tag(full_text, theme, final_elements, model, url, keep_alive)
+            self.save_to_csv([(summary_tag, full_text)])
+
+        # Refill only after this run's own requests are done
+        if to_generate_random and prefetch_pool_size > 0:
+            RANDOM_ELEMENT_POOL.notify()
 
         print(f"Ollama NBP Character Final: {full_text}")
         
         return {"ui": {"text": [full_text]}, "result": (full_text,)}
 
-class OllamaCharacterRestore:
+class OllamaNbpCharacterBatch(OllamaNbpCharacter):
     """
-    Restores full character prompts saved in 'prompts.csv'.
+    Generates several character prompt variations per run, either from one multi-record
+    completion or from bounded parallel requests, and saves them with a single CSV append.
     """
     
+    BATCH_MODES = ["Single Request", "Parallel Requests"]
+    DEFAULT_MAX_PARALLEL = 4
+
     @classmethod
     def INPUT_TYPES(s):
-        elements_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "elements")
-        csv_file_path = os.path.join(elements_dir, "prompts.csv")
+        inputs = super().INPUT_TYPES()
+        inputs["required"]["count"] = ("INT", {"default": 4, "min": 1, "max": 64, "step": 1})
+        inputs["required"]["batch_mode"] = (s.BATCH_MODES,)
+        inputs["optional"]["max_parallel"] = ("INT", {"default": s.DEFAULT_MAX_PARALLEL, "min": 1, "max": 16, "step": 1})
+        # The prefetch pool only serves single-prompt runs
+        inputs["optional"].pop("prefetch_pool_size", None)
+        return inputs
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("Prompts",)
+    OUTPUT_IS_LIST = (True,)
+    FUNCTION = "generate_character_batch"
+    CATEGORY = "Ollama"
+    OUTPUT_NODE = True
+
+    def generate_element_records(self, theme, model, url, keep_alive, seed, to_generate_theme, to_generate_random, count, output_format="Text"):
+        """
+        Asks for `count` variations in one completion and returns the parsed records.
+        """
+        requested = to_generate_theme + to_generate_random
+        if output_format == "JSON Schema":
+            variation_format = f"Respond ONLY with a JSON object whose \"variations\" array holds one object per variation, using these keys: {', '.join(requested)}\n"
+        else:
+            variation_format = "Start each variation with its own line '### Variation <number>', followed by all of the fields above.\n"
+        user_instruction = self.build_user_instruction(
+            theme, to_generate_theme, to_generate_random, output_format,
+            format_note=f"Generate {count} distinct variations. " + variation_format
+        )
+
+        payload = {
+            "model": model,
+            "prompt": self.SYSTEM_INSTRUCTION + user_instruction,
+            "stream": False,
+            "keep_alive": f"{keep_alive}m"
+        }
+        
+        if output_format == "JSON Schema":
+            payload["format"] = {
+                "type": "object",
+                "properties": {
+                    "variations": {
+                        "type": "array",
+                        "items": self.build_json_schema(requested),
+                        "minItems": count,
+                        "maxItems": count,
+                    }
+                },
+                "required": ["variations"],
+            }
+        
+        if seed is not None:
+            payload["options"] = {"seed": seed}
+
+        try:
+            response = ollama_post(url, "/api/generate", payload, "OllamaNbpCharacter.generate")
+            response.raise_for_status()
+            content = response.json().get("response", "")
+            
+            print(f"Ollama Raw Output: {content}")
+
+        except Exception as e:
+            print(f"Ollama API Error: {e}")
+            return []
+
+        mode = "text"
+        records = None
+        if output_format == "JSON Schema":
+            try:
+                data = json.loads(content)
+                variations = data.get("variations", []) if isinstance(data, dict) else data
+                if not isinstance(variations, list):
+                    variations = []
+                records = [r for r in (self.decode_json_elements(v) for v in variations) if r]
+                mode = "json"
+            except json.JSONDecodeError:
+                mode = "json_fallback"
+        
+        if records is None:
+            records = self.parse_records(content)
+        
+        records = records[:count]
+        for generated_data in records:
+            PARSE_STATS.record(mode, requested, generated_data)
+        return records
+
+    def generate_character_batch(self, theme, model, url, keep_alive, count, batch_mode, seed=None, max_parallel=DEFAULT_MAX_PARALLEL, **kwargs):
+        """
+        Generates `count` character prompts and returns them as a list output.
+        """
+        start = time.perf_counter()
+        
+        fixed_elements, to_generate_theme, to_generate_random = self.split_element_inputs(kwargs)
+        output_format = kwargs.get("output_format", "Text")
+        
+        # Threads beyond the scheduler's host limit would only wait in its queue
+        host_limit = SCHEDULER.host_limit(url)
+        workers = min(max_parallel, host_limit)
+        if max_parallel > host_limit and max_parallel != self.DEFAULT_MAX_PARALLEL:
+            print(f"[OllamaNbpCharacterBatch] max_parallel={max_parallel} exceeds the scheduler limit of {host_limit} for {url}; "
+                  f"using {host_limit}. Set OLLAMA_HOST_PARALLEL to match the server's OLLAMA_NUM_PARALLEL.")
+        
+        records = []
+        if to_generate_theme or to_generate_random:
+            if batch_mode == "Single Request":
+                records = self.generate_element_records(theme, model, url, keep_alive, seed, to_generate_theme, to_generate_random, count, output_format)
+                if len(records) < count:
+                    print(f"[OllamaNbpCharacterBatch] Parsed {len(records)}/{count} variations, generating the rest individually")
+            
+            # Parallel mode, or top-up for records the multi-record completion missed
+            missing = count - len(records)
+            if missing > 0:
+                offset = len(records)
+                
+                def generate_one(i):
+                    # Offset the seed so fixed-seed runs still produce distinct variations
+                    variation_seed = None if seed is None else seed + offset + i
+                    return self.generate_elements(
+                        theme, model, url, keep_alive, variation_seed, to_generate_theme, to_generate_random,
+                        output_format=output_format
+                    )
+                
+                with ThreadPoolExecutor(max_workers=min(workers, missing)) as executor:
+                    records += list(executor.map(generate_one, range(missing)))
+        else:
+            records = [{}] * count
+
+        variations = []
+        for generated_data in records:
+            final_elements = dict(fixed_elements)
+            for key in to_generate_theme + to_generate_random:
+                final_elements[key] = generated_data.get(key, "")
+            variations.append((final_elements, self.assemble_prompt(final_elements)))
         
-        saved_prompts = []
+        texts = [full_text for _, full_text in variations]
         
-        if os.path.exists(csv_file_path):
+        elapsed = time.perf_counter() - start
+        print(f"[OllamaNbpCharacterBatch] Generated {count} variations in {elapsed:.2f}s ({elapsed / count:.2f}s per variation, mode: {batch_mode})")
+
+        if kwargs.get("save_to_csv", False):
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                summary_tags = list(executor.map(
+                    lambda v: self.generate_summary_tag(v[1], theme, v[0], model, url, keep_alive),
+                    variations
+                ))
+            self.save_to_csv(list(zip(summary_tags, texts)))
+
+        return {"ui": {"text": texts}, "result": (texts,)}
+
+class RandomElementPool:
+    """
+    Background prefetcher for "Randomised" elements of OllamaNbpCharacter.
+    Keeps a bounded pool of pre-generated element sets per (url, model), filled while Ollama is idle.
+    """
+    
+    RETRY_DELAY = 30.0
+    
+    # Idle policy: the host must have been quiet this long before a refill starts,
+    # so refills do not grab the slot between a workflow's back-to-back requests
+    QUIET_PERIOD = 2.0
+    
+    def __init__(self, refill_policy=None, interval=1.0, keep_alive=None):
+        # "idle": only refill when the host has nothing queued or running
+        # "eager": refill whenever the pool is below its target size
+        self.refill_policy = refill_policy or os.environ.get("OLLAMA_PREFETCH_REFILL", "idle")
+        self.interval = interval
+        if keep_alive is None and os.environ.get("OLLAMA_PREFETCH_KEEP_ALIVE"):
+            # Optional override; by default refills use the node's own keep_alive
             try:
-                with open(csv_file_path, newline='', encoding='utf-8') as csvfile:
+                keep_alive = int(os.environ["OLLAMA_PREFETCH_KEEP_ALIVE"])
+            except ValueError:
+                print("[OllamaNbpCharacter] Ignoring invalid OLLAMA_PREFETCH_KEEP_ALIVE")
+        self.keep_alive = None if keep_alive is None else max(0, keep_alive)
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _pool(self, url, model):
+        pool = self._pools.get((url, model))
+        if pool is None:
+            pool = {
+                "sets": deque(),
+                "target": 0,
+                "keep_alive": 0,
+                "hits": 0,
+                "misses": 0,
+                "generated": 0,
+                "failures": 0,
+                "retry_at": 0.0,
+            }
+            self._pools[(url, model)] = pool
+        return pool
+
+    def take(self, url, model, keys, pool_size, keep_alive):
+        """
+        Returns pre-generated values for the requested keys, or None on a pool miss.
+        Also registers the pool so the prefetcher keeps it filled to pool_size.
+        """
+        with self._lock:
+            pool = self._pool(url, model)
+            pool["target"] = pool_size
+            pool["keep_alive"] = keep_alive
+            while len(pool["sets"]) > pool_size:
+                pool["sets"].popleft()
+            
+            result = None
+            for i, elements in enumerate(pool["sets"]):
+                if all(elements.get(k) for k in keys):
+                    del pool["sets"][i]
+                    result = {k: elements[k] for k in keys}
+                    break
+            
+            if result:
+                pool["hits"] += 1
+            else:
+                pool["misses"] += 1
+
+        self._ensure_worker()
+        return result
+
+    def notify(self):
+        """
+        Wakes the prefetcher. Call once the foreground request has finished,
+        so a refill never takes the slot the caller is about to use.
+        """
+        self._wake.set()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="OllamaPrefetch", daemon=True)
+                self._thread.start()
+
+    def _next_pool(self):
+        now = time.monotonic()
+        with self._lock:
+            for (url, model), pool in self._pools.items():
+                if len(pool["sets"]) >= pool["target"] or now < pool["retry_at"]:
+                    continue
+                if self.refill_policy != "eager" and SCHEDULER.idle_seconds(url) < self.QUIET_PERIOD:
+                    continue
+                keep_alive = pool["keep_alive"] if self.keep_alive is None else self.keep_alive
+                return url, model, keep_alive
+        return None
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            
+            # One refill per wake-up: each refill makes the host busy again, so the
+            # idle policy waits another QUIET_PERIOD before the next one
+            pending = self._next_pool()
+            if pending:
+                self._refill(*pending)
+
+    def _refill(self, url, model, keep_alive):
+        elements = OllamaNbpCharacter.generate_elements(
+            "N/A", model, url, keep_alive, None, [], OllamaNbpCharacter.ELEMENT_INPUTS,
+            call_type="OllamaNbpCharacter.prefetch", workflow_id="prefetch", track_parse=False
+        )
+        
+        with self._lock:
+            pool = self._pool(url, model)
+            if elements:
+                if len(pool["sets"]) < pool["target"]:
+                    pool["sets"].append(elements)
+                pool["generated"] += 1
+            else:
+                pool["failures"] += 1
+                pool["retry_at"] = time.monotonic() + self.RETRY_DELAY
+
+    def stats(self):
+        """
+        Returns pool size and hit-rate metrics per (url, model).
+        """
+        pools = []
+        with self._lock:
+            for (url, model), pool in self._pools.items():
+                requests_seen = pool["hits"] + pool["misses"]
+                pools.append({
+                    "url": url,
+                    "model": model,
+                    "size": len(pool["sets"]),
+                    "target": pool["target"],
+                    "hits": pool["hits"],
+                    "misses": pool["misses"],
+                    "hit_rate": round(pool["hits"] / requests_seen, 3) if requests_seen else 0.0,
+                    "generated": pool["generated"],
+                    "failures": pool["failures"],
+                })
+        return {"refill_policy": self.refill_policy, "pools": pools}
+
+# Shared prefetch pool used by OllamaNbpCharacter
+RANDOM_ELEMENT_POOL = RandomElementPool()
+
+class PromptHistory:
+    """
+    In-memory snapshot of elements/prompts.csv.
+    The file is stat'ed at most every CHECK_INTERVAL seconds and only re-read when its
+    mtime or size changed. Writers in this process call invalidate() to force a check.
+    """
+    
+    CHECK_INTERVAL = 2.0
+    
+    def __init__(self, csv_file_path):
+        self.csv_file_path = csv_file_path
+        self._lock = threading.Lock()
+        self._file_key = None
+        self._checked_at = None
+        self._labels = []
+        self._contents = {}
+        self.etag = '"empty"'
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = None
+
+    def _is_fresh(self):
+        return self._checked_at is not None and time.monotonic() - self._checked_at < self.CHECK_INTERVAL
+
+    def _refresh(self):
+        # Caller must hold self._lock
+        try:
+            st = os.stat(self.csv_file_path)
+            file_key = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            file_key = None
+        
+        if file_key != self._file_key:
+            labels = []
+            contents = {}
+            if file_key is not None:
+                with open(self.csv_file_path, newline='', encoding='utf-8') as csvfile:
                     reader = csv.DictReader(csvfile)
                     # We expect columns: Timestamp, SummaryTag, FullPrompt
                     for row in reader:
@@ -466,13 +1400,60 @@ class OllamaCharacterRestore:
                         # We use a combined string for the dropdown
                         # Format: "YYYY-MM-DD HH:MM:SS - sbj-..."
                         label = f"{ts} - {tag}"
-                        saved_prompts.append(label)
-                    
-                    # Reverse to show newest first
-                    saved_prompts.reverse()
-            except Exception as e:
-                print(f"Error reading prompts.csv: {e}")
-                saved_prompts = [f"Error reading CSV: {e}"]
+                        labels.append(label)
+                        # First match wins, same as a top-down scan
+                        contents.setdefault(label, row.get("FullPrompt", ""))
+                
+                # Reverse to show newest first
+                labels.reverse()
+            
+            self._labels = labels
+            self._contents = contents
+            self._file_key = file_key
+            self.etag = f'"{file_key[0]:x}-{file_key[1]:x}"' if file_key else '"empty"'
+        
+        self._checked_at = time.monotonic()
+
+    def snapshot(self):
+        """
+        Returns (etag, labels newest first, {label: FullPrompt}), re-reading the file if it changed.
+        Blocking: call from an executor when on the event loop.
+        """
+        with self._lock:
+            if not self._is_fresh():
+                self._refresh()
+            return self.etag, self._labels, self._contents
+
+    def cached_snapshot(self):
+        """
+        Returns the snapshot without any disk access, or None if it needs a refresh.
+        Never blocks, so it is safe to call on the event loop.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if self._is_fresh():
+                return self.etag, self._labels, self._contents
+            return None
+        finally:
+            self._lock.release()
+
+# Shared snapshot of the prompt history written by OllamaNbpCharacter
+PROMPT_HISTORY = PromptHistory(os.path.join(os.path.dirname(os.path.realpath(__file__)), "elements", "prompts.csv"))
+
+class OllamaCharacterRestore:
+    """
+    Restores full character prompts saved in 'prompts.csv'.
+    """
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        try:
+            _, labels, _ = PROMPT_HISTORY.snapshot()
+            saved_prompts = list(labels)
+        except Exception as e:
+            print(f"Error reading prompts.csv: {e}")
+            saved_prompts = [f"Error reading CSV: {e}"]
         
         if not saved_prompts:
             saved_prompts = ["No saved prompts found"]
@@ -487,6 +1468,23 @@ class OllamaCharacterRestore:
     def VALIDATE_INPUTS(s, **kwargs):
         return True
 
+    @classmethod
+    def IS_CHANGED(s, **kwargs):
+        """
+        Fingerprints the selected history record, so the node only re-runs when
+        the selection or that record's content changes (not on every new CSV row).
+        """
+        saved_prompts = kwargs.get("saved_prompts")
+        try:
+            _, _, contents = PROMPT_HISTORY.snapshot()
+        except Exception as e:
+            # Unreadable history: force a re-run so restore() reports the error
+            print(f"Error fingerprinting prompts.csv: {e}")
+            return float("NaN")
+        
+        record = contents.get(saved_prompts)
+        return hashlib.sha256(json.dumps([saved_prompts, record]).encode("utf-8")).hexdigest()
+
     RETURN_TYPES = ("STRING",)
     RETURN_NAMES = ("Prompt",)
     FUNCTION = "restore"
@@ -500,25 +1498,14 @@ class OllamaCharacterRestore:
         if saved_prompts == "No saved prompts found" or saved_prompts.startswith("Error"):
              return {"ui": {"text": [""]}, "result": ("",)}
 
-        elements_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "elements")
-        csv_file_path = os.path.join(elements_dir, "prompts.csv")
-        
         full_text = ""
         
-        if not os.path.exists(csv_file_path):
+        if not os.path.exists(PROMPT_HISTORY.csv_file_path):
              return {"ui": {"text": ["Error: prompts.csv not found"]}, "result": ("",)}
              
         try:
-            with open(csv_file_path, newline='', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    ts = row.get("Timestamp", "Unknown Date")
-                    tag = row.get("SummaryTag", "No Tag")
-                    label = f"{ts} - {tag}"
-                    
-                    if label == saved_prompts:
-                        full_text = row.get("FullPrompt", "")
-                        break
+            _, _, contents = PROMPT_HISTORY.snapshot()
+            full_text = contents.get(saved_prompts, "")
         except Exception as e:
             print(f"Error restoring from CSV: {e}")
             full_text = f"Error: {e}"
@@ -631,7 +1618,6 @@ class OllamaImageSaver:
             keywords = "image"
             if model:
                 try:
-                    api_url = f"{url}/api/generate"
                     payload = {
                         "model": model,
                         "prompt": ollama_prompt,
@@ -639,7 +1625,7 @@ class OllamaImageSaver:
                         "stream": False
                     }
                     print(f"Sending image to Ollama ({model})...")
-                    response = requests.post(api_url, json=payload)
+                    response = ollama_post(url, "/api/generate", payload, "OllamaImageSaver.vision")
                     response.raise_for_status()
                     
                     response_data = response.json()
@@ -731,71 +1717,126 @@ class OllamaImageSaver:
 
         return {"ui": {"images": results}}
 
+async def load_prompt_history():
+    """
+    Returns the prompt history snapshot, reading the file in an executor so the
+    event loop is never blocked on disk I/O.
+    """
+    snapshot = PROMPT_HISTORY.cached_snapshot()
+    if snapshot is None:
+        loop = asyncio.get_running_loop()
+        snapshot = await loop.run_in_executor(None, PROMPT_HISTORY.snapshot)
+    return snapshot
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get("If-None-Match", "")
+    return any(tag.strip() in (etag, "*") for tag in if_none_match.split(",") if tag.strip())
+
+def etag_response(request, etag, data):
+    # no-cache: browsers may store the response but must revalidate with If-None-Match
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return web.Response(status=304, headers=headers)
+    return web.json_response(data, headers=headers)
+
 # API Route to fetch CSV prompts list (for refresh)
+@PromptServer.instance.routes.get("/ollama/get_csv_prompts")
 @PromptServer.instance.routes.post("/ollama/get_csv_prompts")
 async def get_csv_prompts(request):
     try:
-        elements_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "elements")
-        csv_file_path = os.path.join(elements_dir, "prompts.csv")
-        
-        saved_prompts = []
-        if os.path.exists(csv_file_path):
-             with open(csv_file_path, newline='', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    ts = row.get("Timestamp", "Unknown Date")
-                    tag = row.get("SummaryTag", "No Tag")
-                    label = f"{ts} - {tag}"
-                    saved_prompts.append(label)
-                saved_prompts.reverse()
+        etag, labels, _ = await load_prompt_history()
         
+        saved_prompts = labels
         if not saved_prompts:
             saved_prompts = ["No saved prompts found"]
             
-        return web.json_response(saved_prompts)
+        return etag_response(request, etag, saved_prompts)
     except Exception as e:
          return web.Response(status=500, text=str(e))
 
 # API Route to fetch CSV content for preview
+@PromptServer.instance.routes.get("/ollama/get_csv_content")
 @PromptServer.instance.routes.post("/ollama/get_csv_content")
 async def get_csv_content(request):
     try:
-        data = await request.json()
-        label_target = data.get("label")
+        if request.method == "GET":
+            label_target = request.query.get("label")
+        else:
+            data = await request.json()
+            label_target = data.get("label")
         
         if not label_target:
              return web.Response(status=400, text="Missing label")
-             
-        elements_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "elements")
-        csv_file_path = os.path.join(elements_dir, "prompts.csv")
         
-        full_text = ""
+        try:
+            _, _, contents = await load_prompt_history()
+            full_text = contents.get(label_target, "")
+        except Exception as e:
+            print(f"Error reading CSV for preview: {e}")
+            full_text = f"Error: {e}"
         
-        if os.path.exists(csv_file_path):
-            try:
-                with open(csv_file_path, newline='', encoding='utf-8') as csvfile:
-                    reader = csv.DictReader(csvfile)
-                    for row in reader:
-                        ts = row.get("Timestamp", "Unknown Date")
-                        tag = row.get("SummaryTag", "No Tag")
-                        label = f"{ts} - {tag}"
-                        
-                        if label == label_target:
-                            full_text = row.get("FullPrompt", "")
-                            break
-            except Exception as e:
-                print(f"Error reading CSV for preview: {e}")
-                full_text = f"Error: {e}"
-                
-        return web.json_response({"content": full_text})
+        # Keyed on the record itself, so appending other rows keeps previews cached
+        etag = '"' + hashlib.sha1(json.dumps([label_target, full_text]).encode("utf-8")).hexdigest() + '"'
+        return etag_response(request, etag, {"content": full_text})
         
     except Exception as e:
         print(f"Error serving CSV content: {e}")
         return web.Response(status=500, text=str(e))
 
+# API Route to inspect scheduler queue depth and wait times
+@PromptServer.instance.routes.get("/ollama/scheduler_stats")
+async def get_scheduler_stats(request):
+    try:
+        return web.json_response(SCHEDULER.stats())
+    except Exception as e:
+        return web.Response(status=500, text=str(e))
+
+# API Route to match a host's concurrency limit to its Ollama server parallelism
+@PromptServer.instance.routes.post("/ollama/scheduler_limits")
+async def set_scheduler_limit(request):
+    try:
+        data = await request.json()
+        url = data.get("url")
+        limit = data.get("limit")
+        
+        if not url or limit is None:
+             return web.Response(status=400, text="Missing url or limit")
+        
+        SCHEDULER.set_host_limit(url, limit)
+        return web.json_response(SCHEDULER.stats())
+    except (TypeError, ValueError) as e:
+        return web.Response(status=400, text=str(e))
+    except Exception as e:
+        return web.Response(status=500, text=str(e))
+
+# API Route to inspect the Randomised element prefetch pool
+@PromptServer.instance.routes.get("/ollama/prefetch_stats")
+async def get_prefetch_stats(request):
+    try:
+        return web.json_response(RANDOM_ELEMENT_POOL.stats())
+    except Exception as e:
+        return web.Response(status=500, text=str(e))
+
+# API Route to inspect how many requested fields were parsed per output mode
+@PromptServer.instance.routes.get("/ollama/parse_stats")
+async def get_parse_stats(request):
+    try:
+        return web.json_response(PARSE_STATS.stats())
+    except Exception as e:
+        return web.Response(status=500, text=str(e))
+
+# API Route to list active OllamaLLMNode sessions
+@PromptServer.instance.routes.get("/ollama/sessions")
+async def get_sessions(request):
+    try:
+        return web.json_response(SESSION_STORE.stats())
+    except Exception as e:
+        return web.Response(status=500, text=str(e))
+
 NODE_CLASS_MAPPINGS = {
     "OllamaLLMNode": OllamaLLMNode,
     "OllamaNbpCharacter": OllamaNbpCharacter,
+    "OllamaNbpCharacterBatch": OllamaNbpCharacterBatch,
     "OllamaCharacterRestore": OllamaCharacterRestore,
     "OllamaImageSaver": OllamaImageSaver
 }
@@ -803,6 +1844,7 @@ NODE_CLASS_MAPPINGS = {
 NODE_DISPLAY_NAME_MAPPINGS = {
     "OllamaLLMNode": "Ollama LLM",
     "OllamaNbpCharacter": "Ollama NBP Character",
+    "OllamaNbpCharacterBatch": "Ollama NBP Character Batch",
     "OllamaCharacterRestore": "Ollama Character Restore",
     "OllamaImageSaver": "Ollama Image Saver"
 }
\ No newline at end of file